@@ -6,31 +6,251 @@ Terminal-based interactive chat with Gemini API and file access
 import os
 import sys
 import json
-import mimetypes
-import base64
 import time
+import mmap
+import threading
+import queue
+import select
+import hashlib
+import sqlite3
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 from pathlib import Path
-from typing import Optional, List, Dict, Any
-import requests
+from typing import TYPE_CHECKING, Optional, List, Dict, Any, Callable
 import argparse
 
+# requests, mimetypes and base64 are imported where they are used so that
+# --help and the REPL banner don't wait on them (requests pulls in ssl,
+# urllib3, charset detection...)
+if TYPE_CHECKING:
+    import requests
+
+try:
+    import orjson  # Optional, much faster (de)serialization of large histories
+except ImportError:
+    orjson = None
+
+VIDEO_MIME_TYPES = {
+    '.mp4': 'video/mp4',
+    '.avi': 'video/x-msvideo',
+    '.mov': 'video/quicktime',
+    '.mkv': 'video/x-matroska',
+    '.webm': 'video/webm',
+    '.flv': 'video/x-flv',
+    '.wmv': 'video/x-ms-wmv',
+    '.m4v': 'video/mp4'
+}
+VIDEO_EXTENSIONS = frozenset(VIDEO_MIME_TYPES)
+
+# Code files are read as text even without a text/* mime type
+CODE_EXTENSIONS = frozenset({
+    '.py', '.js', '.html', '.css', '.java', '.cpp', '.c',
+    '.h', '.json', '.xml', '.yaml', '.yml', '.md', '.txt',
+    '.sh', '.bat', '.ps1', '.sql', '.r', '.php', '.go',
+    '.rs', '.swift', '.kt', '.ts', '.jsx', '.tsx', '.vue'
+})
+
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'})
+
+# Text files are read in 1MB buffered blocks; above this size they are
+# decoded straight from an mmap instead
+TEXT_READ_BUFFER = 1024 * 1024
+TEXT_MMAP_MIN_BYTES = 4 * 1024 * 1024
+
+# Larger images go through the File API instead of inline base64
+INLINE_IMAGE_MAX_BYTES = 4 * 1024 * 1024
+# Base64 encoding block for inline images (must be a multiple of 3)
+IMAGE_ENCODE_BLOCK = 48 * 1024
+
+def json_dumps(obj: Any) -> bytes:
+    """Serialize a request body to compact JSON bytes"""
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def json_loads(data) -> Any:
+    """Parse a JSON response body"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def file_sha256(path: Path) -> bytes:
+    """SHA-256 of a file, using hashlib.file_digest where available"""
+    with open(path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):
+            # Python 3.11+: hashes outside the GIL with OpenSSL's SHA extensions
+            return hashlib.file_digest(f, 'sha256').digest()
+        digest = hashlib.sha256()
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+        return digest.digest()
+
+
+def sha256_matches(digest: bytes, remote_hash: str) -> bool:
+    """Compare a digest with the File API's base64 sha256Hash"""
+    import base64
+    try:
+        remote = base64.b64decode(remote_hash)
+    except ValueError:
+        return False
+    # Accept both the raw digest and its hex form
+    return remote in (digest, digest.hex().encode())
+
+
+# Local state (response cache, ...) lives here
+STATE_DIR = Path.home() / ".terminalai"
+RESPONSE_CACHE_PATH = STATE_DIR / "responses.sqlite3"
+# Cached replies expire, and only the newest ones are kept
+RESPONSE_CACHE_MAX_AGE = 7 * 24 * 3600  # seconds
+RESPONSE_CACHE_MAX_ROWS = 500
+# Unfinished resumable uploads, so they can continue after a restart
+UPLOAD_STATE_PATH = STATE_DIR / "uploads.json"
+# Resumable upload sessions expire server-side; older saved ones are dropped
+UPLOAD_STATE_MAX_AGE = 7 * 24 * 3600  # seconds
+
+def ensure_state_dir():
+    """Create STATE_DIR readable by the current user only
+    
+    It holds upload session URLs (which grant access to the upload) and
+    conversation replies.
+    """
+    STATE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    os.chmod(STATE_DIR, 0o700)  # Also tighten a directory from older versions
+
+
+# Max connections kept to the API; also caps concurrent deletes
+HTTP_POOL_SIZE = 8
+
+# Resumable upload chunk size (must be a multiple of 256KB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_RETRIES = 3
+
+# Processing status polls back off from the first to the max delay
+POLL_INITIAL_DELAY = 0.5  # seconds
+POLL_MAX_DELAY = 15  # seconds
+POLL_MAX_ERRORS = 3
+
+# Files at least this large (in characters) are put in a context cache
+CONTEXT_CACHE_MIN_CHARS = 128 * 1024
+CONTEXT_CACHE_TTL = 3600  # seconds
+
+# Recent exchanges sent verbatim; older ones are replaced by a summary
+HISTORY_KEEP_EXCHANGES = 20
+# Hard cap on stored turns, a backstop should summarizing keep failing
+HISTORY_MAX_TURNS = 64
+# File parts at least this large (and all inline images) are kept out of
+# the history and only attached while they are among, or mentioned by
+# name in, the recent turns
+ARTIFACT_MIN_CHARS = 64 * 1024
+ARTIFACT_RECENT_TURNS = 10
+SUMMARY_PROMPT = ("Summarize the conversation so far in a few paragraphs. Keep every fact, "
+                  "file name, decision and open question needed to continue it.")
+
+class OperationCancelled(Exception):
+    """Raised inside long operations when the user sends /cancel"""
+
+
 class GeminiChat:
-    def __init__(self, api_key: str, allowed_dirs: List[str] = None):
+    def __init__(self, api_key: str, allowed_dirs: List[str] = None, response_cache: bool = True):
         self.api_key = api_key
         self.base_url = "https://generativelanguage.googleapis.com/v1beta"
         self.model = "gemini-1.5-flash"  # or gemini-1.5-pro
         self.allowed_dirs = [Path(d).resolve() for d in (allowed_dirs or ["."])]
-        self.conversation_history = []
+        # Precomputed for is_file_accessible: the dirs themselves and
+        # their "dir/" prefixes (so /data doesn't also allow /database)
+        self._allowed_paths = frozenset(str(d) for d in self.allowed_dirs)
+        self._allowed_prefixes = tuple(os.path.join(str(d), "") for d in self.allowed_dirs)
+        self.conversation_history: deque = deque(maxlen=HISTORY_MAX_TURNS)
+        # Large file parts by id, with the file name they are mentioned
+        # by; the history holds small placeholders
+        self._artifacts: Dict[int, Dict[str, Any]] = {}
+        self._next_artifact_id = 1
+        self._session: Optional["requests.Session"] = None
+        self._session_lock = threading.Lock()
         self.uploaded_files = {}  # Track uploaded files by URI
+        # Background work (e.g. polling video processing) runs here so the
+        # chat can continue while the server is busy
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gemini")
+        self._pending_files: Dict[str, Future] = {}  # File name -> processing poll
+        # Status lines from background work; run() routes them through its
+        # output queue so they don't land mid-prompt or mid-reply
+        self._notify: Callable[[str], None] = print
+        self._shutdown = threading.Event()
+        self._cancel = threading.Event()  # Set by /cancel from the REPL
+        # Server-side context cache holding the stable conversation prefix
+        # (uploaded videos, large files); those turns are moved out of
+        # conversation_history and only referenced by name in requests
+        self.context_cache: Optional[Dict[str, Any]] = None
+        self._cache_requested = False
+        self._cache_error_shown = False
+        # Background summary of old turns: (summarized turns, future)
+        self._summary_job = None
+        # On-disk cache of replies keyed by a hash of the full request,
+        # so repeating an identical prompt skips the API entirely
+        self._response_cache = self._open_response_cache() if response_cache else None
+        # read_file_content dispatch by lowercase file suffix
+        self._file_readers: Dict[str, Callable[[Path, str], Dict[str, Any]]] = {}
+        self._file_readers.update(dict.fromkeys(VIDEO_EXTENSIONS, self._read_uploaded_file))
+        self._file_readers.update(dict.fromkeys(CODE_EXTENSIONS, self._read_text_file))
+        self._file_readers.update(dict.fromkeys(IMAGE_EXTENSIONS, self._read_image_file))
+        # process_message dispatch: command -> handler(args, on_text)
+        self._commands: Dict[str, Callable[[str, Optional[Callable[[str], None]]], str]] = {
+            "/read": self._cmd_read,
+            "/ls": self._cmd_ls,
+            "/list": self._cmd_ls,
+            "/help": self._cmd_help,
+            "/clear": self._cmd_clear,
+            "/cache": self._cmd_cache,
+            "/cleanup": self._cmd_cleanup,
+            "/uploads": self._cmd_uploads,
+            "/dirs": self._cmd_dirs,
+        }
+        
+    @property
+    def session(self) -> "requests.Session":
+        """Shared HTTP session, created on first use"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    from urllib3.util.retry import Retry
+                    
+                    # Reuse connections across requests instead of paying a
+                    # new TCP+TLS handshake for every chat turn
+                    session = requests.Session()
+                    # Idempotent requests (status polls, deletes) are retried
+                    # on transient errors with a short backoff. Retry-After
+                    # isn't slept on here, where it would be uncapped; the
+                    # processing poll applies it with its own limits
+                    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                                  allowed_methods=frozenset({"GET", "DELETE"}),
+                                  respect_retry_after_header=False)
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+    
+    @property
+    def cache_model(self) -> str:
+        """self.model pinned to a version, for use with context caches
         
+        cachedContents only accepts explicitly versioned models, and
+        requests on top of a cache must use the same one.
+        """
+        name, _, version = self.model.rpartition("-")
+        if name and version.isdigit():
+            return self.model
+        return f"{self.model}-001"
+    
     def is_file_accessible(self, file_path: str) -> bool:
         """Check if file is within allowed directories"""
         try:
-            file_path = Path(file_path).resolve()
-            return any(
-                str(file_path).startswith(str(allowed_dir)) 
-                for allowed_dir in self.allowed_dirs
-            )
+            real_path = os.path.realpath(file_path)
+            return real_path in self._allowed_paths or real_path.startswith(self._allowed_prefixes)
         except Exception:
             return False
     
@@ -44,98 +264,92 @@ class GeminiChat:
             if not path.exists():
                 return None
                 
-            mime_type, _ = mimetypes.guess_type(str(path))
-            
-            # Check if it's a supported video format
-            video_formats = {
-                '.mp4': 'video/mp4',
-                '.avi': 'video/x-msvideo', 
-                '.mov': 'video/quicktime',
-                '.mkv': 'video/x-matroska',
-                '.webm': 'video/webm',
-                '.flv': 'video/x-flv',
-                '.wmv': 'video/x-ms-wmv',
-                '.m4v': 'video/mp4'
-            }
-            
-            if path.suffix.lower() not in video_formats:
+            # Check if it's a supported video or image format
+            suffix = path.suffix.lower()
+            mime_type = VIDEO_MIME_TYPES.get(suffix)
+            if not mime_type and suffix in IMAGE_EXTENSIONS:
+                import mimetypes
+                mime_type = mimetypes.guess_type(str(path))[0] or f"image/{suffix[1:]}"
+            if not mime_type:
                 return None
-                
-            mime_type = video_formats[path.suffix.lower()]
             
             # Check file size (Gemini has limits)
-            file_size = path.stat().st_size
+            stat = path.stat()
+            file_size = stat.st_size
             max_size = 2 * 1024 * 1024 * 1024  # 2GB limit
             if file_size > max_size:
                 return {"error": f"File too large: {file_size / (1024*1024*1024):.1f}GB (max 2GB)"}
             
-            print(f"📤 Uploading video file ({file_size / (1024*1024):.1f}MB)...")
-            
-            # Use the resumable upload API
-            # Step 1: Start upload session
-            upload_url = f"{self.base_url}/files"
-            headers = {
-                'X-Goog-Upload-Protocol': 'resumable',
-                'X-Goog-Upload-Command': 'start',
-                'X-Goog-Upload-Header-Content-Length': str(file_size),
-                'X-Goog-Upload-Header-Content-Type': mime_type,
-                'Content-Type': 'application/json'
-            }
-            
-            metadata = {
-                'file': {
-                    'display_name': path.name
-                }
-            }
-            
-            response = requests.post(
-                f"{upload_url}?key={self.api_key}",
-                headers=headers,
-                json=metadata,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                print(f"Failed to start upload session: {response.status_code}")
-                print(f"Response: {response.text}")
-                return {"error": f"Upload session failed: {response.status_code}"}
-            
-            # Get upload URL from response headers
-            upload_session_url = response.headers.get('X-Goog-Upload-URL')
-            if not upload_session_url:
-                return {"error": "No upload URL received"}
+            # Step 1: Resume an interrupted upload of the same file if its
+            # session is still open on the server, otherwise start one
+            state_key = str(path.resolve())
+            mtime_ns = stat.st_mtime_ns
+            upload_session_url = None
+            start_offset = 0
+            started = time.time()
+            saved = self._load_upload_state().get(state_key)
+            if saved and saved.get('size') == file_size and saved.get('mtime_ns') == mtime_ns:
+                server_offset = self._query_upload_offset(saved['url'])
+                if server_offset is not None:
+                    upload_session_url = saved['url']
+                    start_offset = server_offset
+                    started = saved.get('started', started)
             
-            # Step 2: Upload the file content
-            with open(path, 'rb') as f:
-                file_content = f.read()
+            if upload_session_url:
+                print(f"⏯️ Resuming upload of {path.name} at {start_offset / (1024*1024):.1f}MB "
+                      f"of {file_size / (1024*1024):.1f}MB...")
+            else:
+                print(f"📤 Uploading {path.name} ({file_size / (1024*1024):.1f}MB)...")
+                upload_session_url = self._start_upload_session(path, file_size, mime_type)
+                if isinstance(upload_session_url, dict):
+                    return upload_session_url
             
-            headers = {
-                'Content-Length': str(file_size),
-                'X-Goog-Upload-Offset': '0',
-                'X-Goog-Upload-Command': 'upload, finalize'
-            }
+            def save_offset(offset: int):
+                self._update_upload_state(state_key, {
+                    'url': upload_session_url,
+                    'size': file_size,
+                    'mtime_ns': mtime_ns,
+                    'started': started,
+                    'offset': offset  # Shown in the startup banner
+                })
+            save_offset(start_offset)
             
-            response = requests.post(
-                upload_session_url,
-                headers=headers,
-                data=file_content,
-                timeout=300
-            )
+            # Step 2: Upload the file content in chunks, hashing it in the
+            # background meanwhile to verify what the server received
+            digest_future = self._executor.submit(file_sha256, path)
+            response = self._upload_file_chunks(upload_session_url, path, file_size,
+                                                start_offset, save_offset)
+            if response.status_code < 500:
+                # Finalized, or rejected in a way resuming won't fix
+                self._update_upload_state(state_key, None)
             
             if response.status_code == 200:
-                result = response.json()
+                result = json_loads(response.content)
                 file_uri = result.get('file', {}).get('uri')
                 if file_uri:
+                    digest = digest_future.result()
+                    remote_hash = result.get('file', {}).get('sha256Hash')
+                    if remote_hash and not sha256_matches(digest, remote_hash):
+                        self.delete_uploaded_file(result.get('file', {}).get('name'))
+                        return {"error": "Upload corrupted: SHA-256 checksum mismatch"}
+                    
                     self.uploaded_files[file_path] = {
                         'uri': file_uri,
                         'name': result.get('file', {}).get('name'),
                         'mime_type': mime_type,
-                        'size': file_size
+                        'size': file_size,
+                        'sha256': digest.hex()
                     }
                     
-                    # Wait for processing
-                    print("⏳ Processing video...")
-                    self.wait_for_file_processing(result.get('file', {}).get('name'))
+                    # Poll processing in the background; call_gemini waits
+                    # for it before the file is referenced in a request
+                    file_name = result.get('file', {}).get('name')
+                    if file_name:
+                        kind = "Video" if mime_type.startswith('video/') else "Image"
+                        print(f"⏳ Processing {kind.lower()} in the background...")
+                        self._pending_files[file_name] = self._executor.submit(
+                            self.wait_for_file_processing, file_name, kind=kind
+                        )
                     
                     return {
                         'uri': file_uri,
@@ -146,52 +360,282 @@ class GeminiChat:
             print(f"Response: {response.text}")
             return {"error": f"Upload failed: {response.status_code} - {response.text}"}
             
+        except OperationCancelled:
+            raise
         except Exception as e:
             print(f"Exception during upload: {str(e)}")
             return {"error": f"Error uploading file: {str(e)}"}
     
-    def wait_for_file_processing(self, file_name: str, max_wait: int = 300):
-        """Wait for file processing to complete"""
+    def _start_upload_session(self, path: Path, file_size: int, mime_type: str):
+        """Open a resumable upload session, returning its URL or an error dict"""
+        upload_url = f"{self.base_url}/files"
+        headers = {
+            'X-Goog-Upload-Protocol': 'resumable',
+            'X-Goog-Upload-Command': 'start',
+            'X-Goog-Upload-Header-Content-Length': str(file_size),
+            'X-Goog-Upload-Header-Content-Type': mime_type,
+            'Content-Type': 'application/json'
+        }
+        
+        metadata = {
+            'file': {
+                'display_name': path.name
+            }
+        }
+        
+        response = self.session.post(
+            f"{upload_url}?key={self.api_key}",
+            headers=headers,
+            data=json_dumps(metadata),
+            timeout=30
+        )
+        
+        if response.status_code != 200:
+            print(f"Failed to start upload session: {response.status_code}")
+            print(f"Response: {response.text}")
+            return {"error": f"Upload session failed: {response.status_code}"}
+        
+        # Get upload URL from response headers
+        upload_session_url = response.headers.get('X-Goog-Upload-URL')
+        if not upload_session_url:
+            return {"error": "No upload URL received"}
+        return upload_session_url
+    
+    def _query_upload_offset(self, upload_session_url: str) -> Optional[int]:
+        """Ask the upload session how many bytes it has received so far"""
+        import requests
+        try:
+            response = self.session.post(
+                upload_session_url,
+                headers={'X-Goog-Upload-Command': 'query'},
+                timeout=30
+            )
+            if response.status_code == 200:
+                # Sessions that were finalized or cancelled can't continue
+                if response.headers.get('X-Goog-Upload-Status', 'active') != 'active':
+                    return None
+                return int(response.headers.get('X-Goog-Upload-Size-Received', 0))
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        return None
+    
+    def _upload_file_chunks(self, upload_session_url: str, path: Path, file_size: int,
+                            offset: int = 0, on_progress: Optional[Callable[[int], None]] = None):
+        """Upload file content chunk by chunk, resuming from the server offset on errors
+        
+        on_progress, if given, is called with the new offset after each acknowledged chunk.
+        """
+        import requests
+        retries = 0
+        # Map the file so each chunk is a view of the page cache rather
+        # than a fresh copy read into a Python bytes object
+        f = open(path, 'rb')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if file_size else b''
+        view = memoryview(mm)
+        try:
+            while True:
+                if self._cancel.is_set():
+                    raise OperationCancelled("cancelled, /read the file again to resume")
+                chunk = view[offset:offset + UPLOAD_CHUNK_SIZE]
+                is_last = offset + len(chunk) >= file_size
+                headers = {
+                    'Content-Length': str(len(chunk)),
+                    'X-Goog-Upload-Offset': str(offset),
+                    'X-Goog-Upload-Command': 'upload, finalize' if is_last else 'upload'
+                }
+            
+                error = None
+                response = None
+                try:
+                    response = self.session.post(
+                        upload_session_url,
+                        headers=headers,
+                        # requests would send an empty view with chunked encoding
+                        data=chunk if len(chunk) else b'',
+                        timeout=300
+                    )
+                except requests.exceptions.RequestException as e:
+                    error = e
+            
+                if response is not None and response.status_code == 200:
+                    if is_last:
+                        return response
+                    offset += len(chunk)
+                    retries = 0
+                    if on_progress:
+                        on_progress(offset)
+                    continue
+            
+                retries += 1
+                if retries > UPLOAD_MAX_RETRIES:
+                    if error:
+                        raise error
+                    return response
+            
+                print(f"⚠️ Upload chunk at {offset / (1024*1024):.1f}MB failed, retrying ({retries}/{UPLOAD_MAX_RETRIES})...")
+                # Continue from whatever the server actually received
+                server_offset = self._query_upload_offset(upload_session_url)
+                if server_offset is not None:
+                    offset = server_offset
+        finally:
+            view.release()
+            if file_size:
+                try:
+                    mm.close()
+                except BufferError:
+                    # A lingering traceback still references a chunk; the
+                    # mapping is released once it is garbage collected
+                    pass
+            f.close()
+    
+    def _load_upload_state(self) -> Dict[str, Any]:
+        """Read the saved state of unfinished uploads"""
+        try:
+            with open(UPLOAD_STATE_PATH, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _update_upload_state(self, key: str, entry: Optional[Dict[str, Any]]):
+        """Save (or with entry=None, forget) the state of one upload"""
+        state = self._load_upload_state()
+        if entry is None:
+            if state.pop(key, None) is None:
+                return
+        else:
+            state[key] = entry
+        self._save_upload_state(state)
+    
+    def _prune_upload_state(self) -> Dict[str, Any]:
+        """Forget uploads whose file changed or is gone, or whose session has expired
+        
+        Returns the remaining, still resumable uploads.
+        """
+        state = self._load_upload_state()
+        now = time.time()
+        resumable = {}
+        for file_path, entry in state.items():
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            if (stat.st_size == entry.get('size') and stat.st_mtime_ns == entry.get('mtime_ns')
+                    and now - entry.get('started', 0) < UPLOAD_STATE_MAX_AGE):
+                resumable[file_path] = entry
+        if len(resumable) != len(state):
+            self._save_upload_state(resumable)
+        return resumable
+    
+    def _save_upload_state(self, state: Dict[str, Any]):
+        """Write the state of unfinished uploads"""
+        try:
+            ensure_state_dir()
+            tmp_path = UPLOAD_STATE_PATH.with_suffix('.tmp')
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp_path, UPLOAD_STATE_PATH)
+        except OSError:
+            pass
+    
+    def wait_for_file_processing(self, file_name: str, max_wait: int = 300, kind: str = "File"):
+        """Wait for file processing to complete
+        
+        kind ("Video", "Image", ...) names the file in status messages.
+        """
         if not file_name:
             return
             
         start_time = time.time()
+        delay = POLL_INITIAL_DELAY
+        errors = 0
         while time.time() - start_time < max_wait:
+            pause = delay
             try:
-                response = requests.get(
+                response = self.session.get(
                     f"{self.base_url}/files/{file_name}?key={self.api_key}",
                     timeout=10
                 )
+                errors = 0
+                
+                # Honor the server's polling hint when it gives one
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    pause = min(int(retry_after), POLL_MAX_DELAY)
                 
                 if response.status_code == 200:
-                    result = response.json()
+                    result = json_loads(response.content)
                     state = result.get('state', 'PROCESSING')
                     
                     if state == 'ACTIVE':
-                        print("✅ Video processing complete!")
+                        self._notify(f"✅ {kind} processing complete!")
                         return
                     elif state == 'FAILED':
-                        print("❌ Video processing failed")
+                        self._notify(f"❌ {kind} processing failed")
                         return
-                        
-                time.sleep(2)
                 
             except Exception as e:
-                print(f"⚠️ Error checking processing status: {e}")
-                break
+                errors += 1
+                self._notify(f"⚠️ Error checking processing status: {e}")
+                if errors >= POLL_MAX_ERRORS:
+                    break
                 
-        print("⚠️ Processing timeout - continuing anyway")
+            # Don't sleep past max_wait
+            remaining = max_wait - (time.time() - start_time)
+            if self._shutdown.wait(max(0, min(pause, remaining))):
+                return
+            delay = min(delay * 2, POLL_MAX_DELAY)
+                
+        self._notify(f"⚠️ {kind} processing timeout - continuing anyway")
+    
+    def wait_for_pending_files(self):
+        """Block until background processing of uploaded files has finished"""
+        pending = [f for f in self._pending_files.values() if not f.done()]
+        if pending:
+            print("⏳ Waiting for upload processing to finish...")
+        while pending:
+            # Wake up regularly so /cancel can interrupt the wait
+            _, pending = wait(pending, timeout=0.2)
+            if pending and self._cancel.is_set():
+                raise OperationCancelled("cancelled while waiting for upload processing")
+        for future in list(self._pending_files.values()):
+            try:
+                future.result()
+            except Exception:
+                pass
+        self._pending_files.clear()
+    
+    def close(self):
+        """Stop background work"""
+        self._shutdown.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        # Don't leave a cache billed until its TTL runs out
+        self.delete_context_cache(restore=False)
+        if self._session:
+            self._session.close()
+        if self._response_cache:
+            self._response_cache.close()
     
     def delete_uploaded_file(self, file_name: str):
         """Delete uploaded file from Gemini"""
         try:
-            response = requests.delete(
+            response = self.session.delete(
                 f"{self.base_url}/files/{file_name}?key={self.api_key}",
                 timeout=10
             )
-            return response.status_code == 204
+            return response.status_code in (200, 204)
         except Exception:
             return False
+    
+    def delete_uploaded_files(self) -> int:
+        """Delete all uploaded files concurrently, returning how many were deleted"""
+        names = [info.get('name') for info in self.uploaded_files.values() if info.get('name')]
+        self.uploaded_files.clear()
+        if not names:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(len(names), HTTP_POOL_SIZE)) as executor:
+            return sum(executor.map(self.delete_uploaded_file, names))
+    
     def read_file_content(self, file_path: str) -> Optional[Dict[str, Any]]:
         """Read file content and return in format suitable for Gemini"""
         if not self.is_file_accessible(file_path):
@@ -202,66 +646,86 @@ class GeminiChat:
             if not path.exists():
                 return None
                 
-            mime_type, _ = mimetypes.guess_type(str(path))
+            reader = self._file_readers.get(path.suffix.lower())
+            if reader:
+                return reader(path, file_path)
             
-            # Check if it's a video file
-            video_extensions = {'.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv', '.m4v'}
-            if path.suffix.lower() in video_extensions:
-                # Upload video to Gemini
-                upload_result = self.upload_file_to_gemini(file_path)
-                if upload_result and 'uri' in upload_result:
-                    return {
-                        "file_data": {
-                            "file_uri": upload_result['uri'],
-                            "mime_type": upload_result['mime_type']
-                        }
-                    }
-                elif upload_result and 'error' in upload_result:
-                    return {"text": f"❌ {upload_result['error']}"}
-                else:
-                    return {"text": f"❌ Failed to upload video: {file_path}"}
+            import mimetypes
+            mime_type, _ = mimetypes.guess_type(str(path))
             
             # For text files, read as text
             if mime_type and mime_type.startswith('text/'):
-                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                return {
-                    "text": f"File: {file_path}\n\n{content}"
-                }
-            
-            # For code files without proper mime type
-            code_extensions = {'.py', '.js', '.html', '.css', '.java', '.cpp', '.c', 
-                             '.h', '.json', '.xml', '.yaml', '.yml', '.md', '.txt',
-                             '.sh', '.bat', '.ps1', '.sql', '.r', '.php', '.go',
-                             '.rs', '.swift', '.kt', '.ts', '.jsx', '.tsx', '.vue'}
-            
-            if path.suffix.lower() in code_extensions:
-                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                return {
-                    "text": f"File: {file_path}\n\n{content}"
-                }
-            
-            # For image files, encode as base64
-            image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
-            if path.suffix.lower() in image_extensions:
-                with open(path, 'rb') as f:
-                    image_data = base64.b64encode(f.read()).decode()
-                return {
-                    "inline_data": {
-                        "mime_type": mime_type or f"image/{path.suffix[1:]}",
-                        "data": image_data
-                    }
-                }
+                return self._read_text_file(path, file_path)
                 
             # For other files, just mention the file exists
             return {
                 "text": f"File exists: {file_path} (binary file, {mime_type or 'unknown type'})"
             }
             
+        except OperationCancelled:
+            raise
         except Exception as e:
             return {"text": f"Error reading file {file_path}: {str(e)}"}
     
+    def _read_uploaded_file(self, path: Path, file_path: str) -> Dict[str, Any]:
+        """Upload a video or large image to Gemini and reference it by URI"""
+        upload_result = self.upload_file_to_gemini(file_path)
+        if upload_result and 'uri' in upload_result:
+            return {
+                "file_data": {
+                    "file_uri": upload_result['uri'],
+                    "mime_type": upload_result['mime_type']
+                }
+            }
+        elif upload_result and 'error' in upload_result:
+            return {"text": f"❌ {upload_result['error']}"}
+        else:
+            return {"text": f"❌ Failed to upload file: {file_path}"}
+    
+    def _read_text_file(self, path: Path, file_path: str) -> Dict[str, Any]:
+        """Read a text or code file"""
+        with open(path, 'rb', buffering=TEXT_READ_BUFFER) as f:
+            fd = f.fileno()
+            if hasattr(os, 'posix_fadvise'):
+                try:
+                    # The whole file is read front to back; ask for read-ahead
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                except OSError:
+                    pass
+            if os.fstat(fd).st_size >= TEXT_MMAP_MIN_BYTES:
+                # Decode from the page cache without an intermediate bytes copy
+                with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                    content = str(mm, 'utf-8', 'ignore')
+            else:
+                content = f.read().decode('utf-8', 'ignore')
+        if '\r' in content:
+            # Match text mode's universal newlines
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+        return {
+            "text": f"File: {file_path}\n\n{content}"
+        }
+    
+    def _read_image_file(self, path: Path, file_path: str) -> Dict[str, Any]:
+        """Read an image as base64 inline data, uploading it if it is large"""
+        if path.stat().st_size > INLINE_IMAGE_MAX_BYTES:
+            return self._read_uploaded_file(path, file_path)
+        
+        import base64
+        import mimetypes
+        mime_type, _ = mimetypes.guess_type(str(path))
+        # Encode block by block so the raw image is never fully in memory
+        encoded = bytearray()
+        with open(path, 'rb') as f:
+            while block := f.read(IMAGE_ENCODE_BLOCK):
+                encoded += base64.b64encode(block)
+        image_data = encoded.decode('ascii')
+        return {
+            "inline_data": {
+                "mime_type": mime_type or f"image/{path.suffix[1:]}",
+                "data": image_data
+            }
+        }
+    
     def list_files(self, directory: str = ".") -> str:
         """List files in directory"""
         if not self.is_file_accessible(directory):
@@ -273,124 +737,194 @@ class GeminiChat:
                 return f"Directory {directory} does not exist"
                 
             files = []
-            for item in sorted(path.iterdir()):
-                if item.is_file():
-                    size = item.stat().st_size
+            # scandir's entries answer is_file/is_dir from the directory
+            # listing itself, so only regular files need a stat call
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+            for entry in entries:
+                if entry.is_file():
+                    size = entry.stat().st_size
                     # Add video file indicators
-                    video_exts = {'.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv', '.m4v'}
-                    if item.suffix.lower() in video_exts:
-                        files.append(f"🎬 {item.name} ({size / (1024*1024):.1f}MB)")
+                    if os.path.splitext(entry.name)[1].lower() in VIDEO_EXTENSIONS:
+                        files.append(f"🎬 {entry.name} ({size / (1024*1024):.1f}MB)")
                     else:
-                        files.append(f"📄 {item.name} ({size} bytes)")
-                elif item.is_dir():
-                    files.append(f"📁 {item.name}/")
+                        files.append(f"📄 {entry.name} ({size} bytes)")
+                elif entry.is_dir():
+                    files.append(f"📁 {entry.name}/")
                     
             return f"Contents of {directory}:\n" + "\n".join(files)
         except Exception as e:
             return f"Error listing directory {directory}: {str(e)}"
     
-    def process_message(self, user_input: str) -> str:
-        """Process user message and handle file operations"""
+    def process_message(self, user_input: str, on_text: Optional[Callable[[str], None]] = None) -> str:
+        """Process user message and handle file operations
         
-        # Check for file commands
-        if user_input.startswith("/read "):
-            file_path = user_input[6:].strip()
+        on_text, if given, receives Gemini's reply incrementally as it streams in.
+        """
+        
+        # Commands are looked up by their first word; anything else is chat
+        command, _, args = user_input.partition(" ")
+        handler = self._commands.get(command)
+        if handler:
+            return handler(args.strip(), on_text)
+        
+        # Regular chat message
+        return self.call_gemini(user_input, on_text)
+    
+    def _cmd_read(self, file_path: str, on_text: Optional[Callable[[str], None]]) -> str:
+        """/read <file_path>"""
+        if not file_path:
+            return "❌ Usage: /read <file_path>"
+        try:
             file_content = self.read_file_content(file_path)
-            if file_content:
-                # Add file content to conversation and ask Gemini about it
-                self.conversation_history.append({
-                    "role": "user",
-                    "parts": [file_content]
-                })
-                return self.call_gemini(f"I've shared the file {file_path} with you. Please analyze it and tell me about its contents.")
-            else:
-                return f"❌ Cannot access file: {file_path}"
-                
-        elif user_input.startswith("/ls") or user_input.startswith("/list"):
-            directory = user_input.split(maxsplit=1)[1] if len(user_input.split()) > 1 else "."
-            return self.list_files(directory)
-            
-        elif user_input.startswith("/help"):
-            return self.show_help()
-            
-        elif user_input.startswith("/clear"):
-            self.conversation_history.clear()
-            return "🧹 Conversation history cleared"
-            
-        elif user_input.startswith("/cleanup"):
-            # Clean up uploaded files
-            cleaned = 0
-            for file_path, file_info in list(self.uploaded_files.items()):
-                file_name = file_info.get('name')
-                if file_name and self.delete_uploaded_file(file_name):
-                    cleaned += 1
-                del self.uploaded_files[file_path]
-            return f"🧹 Cleaned up {cleaned} uploaded files"
-            
-        elif user_input.startswith("/uploads"):
-            if not self.uploaded_files:
-                return "📁 No uploaded files"
-            files_info = []
-            for file_path, info in self.uploaded_files.items():
-                size_mb = info.get('size', 0) / (1024 * 1024)
-                files_info.append(f"🎬 {Path(file_path).name} ({size_mb:.1f}MB)")
-        elif user_input.startswith("/dirs"):
-            return "📁 Allowed directories:\n" + "\n".join(str(d) for d in self.allowed_dirs)
-            
-        else:
-            # Regular chat message
-            return self.call_gemini(user_input)
+        except OperationCancelled:
+            # Nothing was shared, so there is nothing to ask about
+            return "🛑 Cancelled"
+        if not file_content:
+            return f"❌ Cannot access file: {file_path}"
+        
+        # Add file content to conversation and ask Gemini about it
+        self.conversation_history.append({
+            "role": "user",
+            "parts": [self._store_part(file_content, file_path)]
+        })
+        is_video = file_content.get("file_data", {}).get("mime_type", "").startswith("video/")
+        if is_video or len(file_content.get("text", "")) >= CONTEXT_CACHE_MIN_CHARS:
+            # Cache it on the next request so follow-up turns don't
+            # resend the whole file
+            self._cache_requested = True
+        if "file_data" in file_content and self._pending_files:
+            # Let the user type their question while the upload is
+            # still processing instead of blocking on it here
+            return f"{'🎬' if is_video else '🖼️'} {file_path} uploaded and processing in the background. Ask me anything about it!"
+        return self.call_gemini(f"I've shared the file {file_path} with you. Please analyze it and tell me about its contents.", on_text)
+    
+    def _cmd_ls(self, directory: str, on_text) -> str:
+        """/ls [directory]"""
+        return self.list_files(directory or ".")
+    
+    def _cmd_help(self, args: str, on_text) -> str:
+        """/help"""
+        return self.show_help()
+    
+    def _cmd_clear(self, args: str, on_text) -> str:
+        """/clear"""
+        self.conversation_history.clear()
+        self._artifacts.clear()
+        self.delete_context_cache(restore=False)
+        return "🧹 Conversation history cleared"
+    
+    def _cmd_cache(self, args: str, on_text) -> str:
+        """/cache [clear]"""
+        if args == "clear":
+            deleted = self.delete_context_cache()
+            cleared = self.clear_response_cache()
+            return f"🧹 {'Context cache deleted, ' if deleted else ''}{cleared} cached responses cleared"
+        return self.show_context_cache() + "\n" + self.show_response_cache()
     
-    def call_gemini(self, message: str) -> str:
-        """Make API call to Gemini"""
+    def _cmd_cleanup(self, args: str, on_text) -> str:
+        """/cleanup"""
+        cleaned = self.delete_uploaded_files()
+        return f"🧹 Cleaned up {cleaned} uploaded files"
+    
+    def _cmd_uploads(self, args: str, on_text) -> str:
+        """/uploads"""
+        if not self.uploaded_files:
+            return "📁 No uploaded files"
+        files_info = []
+        for file_path, info in self.uploaded_files.items():
+            size_mb = info.get('size', 0) / (1024 * 1024)
+            icon = "🎬" if info.get('mime_type', '').startswith('video/') else "🖼️"
+            files_info.append(f"{icon} {Path(file_path).name} ({size_mb:.1f}MB)")
+        return "📁 Uploaded files:\n" + "\n".join(files_info)
+    
+    def _cmd_dirs(self, args: str, on_text) -> str:
+        """/dirs"""
+        return "📁 Allowed directories:\n" + "\n".join(str(d) for d in self.allowed_dirs)
+    
+    def call_gemini(self, message: str, on_text: Optional[Callable[[str], None]] = None) -> str:
+        """Make API call to Gemini, streaming the reply to on_text if given"""
+        import requests
+        user_turn = None
         try:
-            # Add user message to history
-            self.conversation_history.append({
+            self._apply_history_summary()
+            
+            if self.context_cache and time.time() >= self.context_cache['expires']:
+                # Expired: its turns go back into the history
+                self.delete_context_cache()
+            
+            user_turn = {
                 "role": "user",
                 "parts": [{"text": message}]
-            })
-            
-            # Prepare API request
-            url = f"{self.base_url}/models/{self.model}:generateContent"
-            headers = {
-                "Content-Type": "application/json",
             }
+            # A stored reply makes waiting on uploads or creating a
+            # context cache unnecessary, so look it up first
+            cache_key = self._response_cache_key(user_turn)
+            ai_response = self._get_cached_response(cache_key)
+            if ai_response is not None:
+                self.conversation_history.append(user_turn)
+                self.conversation_history.append({
+                    "role": "model",
+                    "parts": [{"text": ai_response}]
+                })
+                return ai_response
             
-            data = {
-                "contents": self.conversation_history,
-                "generationConfig": {
-                    "temperature": 0.7,
-                    "topK": 40,
-                    "topP": 0.95,
-                    "maxOutputTokens": 8192,
-                }
-            }
+            # Uploaded files must be ACTIVE before they can be referenced
+            self.wait_for_pending_files()
             
-            response = requests.post(
-                f"{url}?key={self.api_key}",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
+            if self._cache_requested:
+                self._cache_requested = False
+                self.create_context_cache()
+            
+            # Add user message to history
+            self.conversation_history.append(user_turn)
+            
+            contents = self._build_contents(self.conversation_history)
+            stream = on_text is not None
+            response = self._post_generate_content(contents, stream)
+            if response.status_code != 200 and self.context_cache and self._is_cache_missing(response):
+                # The cache expired or was deleted server-side; fall back
+                # to sending the full conversation. Other errors (rate
+                # limits, a bad message) keep the cache and are reported.
+                response.close()
+                self.delete_context_cache()
+                contents = self._build_contents(self.conversation_history)
+                response = self._post_generate_content(contents, stream)
             
             if response.status_code == 200:
-                result = response.json()
-                if 'candidates' in result and len(result['candidates']) > 0:
-                    ai_response = result['candidates'][0]['content']['parts'][0]['text']
-                    
+                truncated = False
+                if stream:
+                    ai_response, truncated = self._read_stream(response, on_text)
+                else:
+                    result = json_loads(response.content)
+                    ai_response = None
+                    if 'candidates' in result and len(result['candidates']) > 0:
+                        ai_response = result['candidates'][0]['content']['parts'][0]['text']
+                
+                if ai_response:
                     # Add AI response to history
                     self.conversation_history.append({
                         "role": "model",
                         "parts": [{"text": ai_response}]
                     })
+                    if not truncated:
+                        # A reply cut short by /cancel stays in the history only
+                        self._store_cached_response(cache_key, ai_response)
+                    self._prune_artifacts()
+                    self._start_history_summary()
                     
                     return ai_response
                 else:
                     return "❌ No response generated"
             else:
-                error_details = response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text
+                error_details = json_loads(response.content) if response.headers.get('content-type', '').startswith('application/json') else response.text
                 return f"❌ API Error ({response.status_code}): {error_details}"
                 
+        except OperationCancelled:
+            # Without a reply the message would be resent with the next one
+            if self.conversation_history and self.conversation_history[-1] is user_turn:
+                self.conversation_history.pop()
+            return "🛑 Cancelled"
         except requests.exceptions.Timeout:
             return "❌ Request timed out. Please try again."
         except requests.exceptions.RequestException as e:
@@ -398,6 +932,358 @@ class GeminiChat:
         except Exception as e:
             return f"❌ Error: {str(e)}"
     
+    def _post_generate_content(self, contents: List[Dict[str, Any]], stream: bool = False,
+                               use_context_cache: bool = True):
+        """Send contents to generateContent, on top of the context cache if any"""
+        use_context_cache = use_context_cache and self.context_cache is not None
+        model = self.cache_model if use_context_cache else self.model
+        if stream:
+            url = f"{self.base_url}/models/{model}:streamGenerateContent?alt=sse&"
+        else:
+            url = f"{self.base_url}/models/{model}:generateContent?"
+        headers = {
+            "Content-Type": "application/json",
+        }
+        
+        data = {
+            "contents": contents,
+            "generationConfig": {
+                "temperature": 0.7,
+                "topK": 40,
+                "topP": 0.95,
+                "maxOutputTokens": 8192,
+            }
+        }
+        
+        if use_context_cache:
+            data["cachedContent"] = self.context_cache['name']
+        
+        return self.session.post(
+            f"{url}key={self.api_key}",
+            headers=headers,
+            data=json_dumps(data),
+            stream=stream,
+            timeout=30
+        )
+    
+    def _is_cache_missing(self, response) -> bool:
+        """Whether an error response means the context cache no longer exists"""
+        if response.status_code == 404:
+            return True
+        return response.status_code == 403 and 'cachedcontent' in response.text.lower()
+    
+    def _start_history_summary(self):
+        """Summarize turns outside the recent window in the background"""
+        keep = 2 * HISTORY_KEEP_EXCHANGES
+        if self._summary_job or len(self.conversation_history) <= keep:
+            return
+        old_turns = list(islice(self.conversation_history, len(self.conversation_history) - keep))
+        self._summary_job = (old_turns, self._executor.submit(self._summarize_turns, old_turns))
+    
+    def _summarize_turns(self, turns: List[Dict[str, Any]]) -> Optional[str]:
+        """Ask Gemini for a summary of the given turns"""
+        # With the files themselves, so the summary can stand in for them
+        contents = self._build_contents(turns, recent_turns=None)
+        contents.append({"role": "user", "parts": [{"text": SUMMARY_PROMPT}]})
+        response = self._post_generate_content(contents, use_context_cache=False)
+        if response.status_code != 200:
+            return None
+        candidates = json_loads(response.content).get('candidates', [])
+        if not candidates:
+            return None
+        return candidates[0]['content']['parts'][0].get('text')
+    
+    def _apply_history_summary(self):
+        """Replace summarized turns with their summary once it is ready"""
+        if not self._summary_job or not self._summary_job[1].done():
+            return
+        old_turns, future = self._summary_job
+        self._summary_job = None
+        try:
+            summary = future.result()
+        except Exception:
+            return
+        
+        # Skip if the history changed underneath (e.g. /clear or caching)
+        current = list(islice(self.conversation_history, len(old_turns)))
+        if not summary or len(current) != len(old_turns) or any(a is not b for a, b in zip(current, old_turns)):
+            return
+        for _ in old_turns:
+            self.conversation_history.popleft()
+        self.conversation_history.appendleft({
+            "role": "user",
+            "parts": [{"text": f"Summary of our earlier conversation:\n{summary}"}]
+        })
+        if self.conversation_history.maxlen > HISTORY_MAX_TURNS:
+            # Back under the cap after a restored context cache
+            self.conversation_history = deque(self.conversation_history,
+                                              maxlen=max(HISTORY_MAX_TURNS, len(self.conversation_history)))
+        self._prune_artifacts()
+    
+    def _store_part(self, part: Dict[str, Any], label: str) -> Dict[str, Any]:
+        """Keep a large file part out of line, returning the part to put in the history"""
+        if "inline_data" not in part and len(part.get("text", "")) < ARTIFACT_MIN_CHARS:
+            return part
+        artifact_id = self._next_artifact_id
+        self._next_artifact_id += 1
+        self._artifacts[artifact_id] = {"name": Path(label).name, "part": part}
+        return {"_artifact": artifact_id, "text": f"[artifact#{artifact_id}: {label}, no longer attached]"}
+    
+    def _build_contents(self, turns, recent_turns: Optional[int] = ARTIFACT_RECENT_TURNS) -> List[Dict[str, Any]]:
+        """Turn history entries into request contents
+        
+        Artifacts referenced in, or whose file name is mentioned in, the
+        last recent_turns turns (all of them if None) are spliced back in;
+        older ones are sent as their placeholder.
+        """
+        turns = list(turns)
+        attached = None
+        if recent_turns is not None:
+            recent = turns[-recent_turns:] if recent_turns else []
+            attached = {part["_artifact"] for turn in recent for part in turn["parts"] if "_artifact" in part}
+            mentioned = "\n".join(part["text"] for turn in recent for part in turn["parts"]
+                                  if "text" in part and "_artifact" not in part)
+            attached.update(artifact_id for artifact_id, artifact in list(self._artifacts.items())
+                            if artifact["name"] in mentioned)
+        contents = []
+        for turn in turns:
+            if not any("_artifact" in part for part in turn["parts"]):
+                contents.append(turn)
+                continue
+            parts = []
+            for part in turn["parts"]:
+                if "_artifact" not in part:
+                    parts.append(part)
+                    continue
+                # .get: the summary thread builds contents concurrently
+                artifact = self._artifacts.get(part["_artifact"])
+                if artifact and (attached is None or part["_artifact"] in attached):
+                    parts.append(artifact["part"])
+                else:
+                    parts.append({"text": part["text"]})
+            contents.append({"role": turn["role"], "parts": parts})
+        return contents
+    
+    def _prune_artifacts(self):
+        """Forget artifacts no longer referenced from the history or the context cache"""
+        turns = list(self.conversation_history)
+        if self.context_cache:
+            turns += self.context_cache['contents']
+        referenced = {part["_artifact"] for turn in turns
+                      for part in turn["parts"] if "_artifact" in part}
+        for artifact_id in list(self._artifacts):
+            if artifact_id not in referenced:
+                del self._artifacts[artifact_id]
+    
+    def _read_stream(self, response, on_text: Callable[[str], None]) -> tuple:
+        """Decode a server-sent event stream, passing text on as it arrives
+        
+        Returns the text and whether /cancel cut it short.
+        """
+        # SSE has no charset parameter, requests would assume ISO-8859-1
+        response.encoding = 'utf-8'
+        chunks = []
+        for line in response.iter_lines(decode_unicode=True):
+            if self._cancel.is_set():
+                response.close()
+                if not chunks:
+                    raise OperationCancelled("cancelled before any reply arrived")
+                # Keep whatever arrived so far as the reply
+                return "".join(chunks), True
+            if not line or not line.startswith('data:'):
+                continue
+            event = json_loads(line[5:])
+            for candidate in event.get('candidates', [])[:1]:
+                for part in candidate.get('content', {}).get('parts', []):
+                    text = part.get('text')
+                    if text:
+                        chunks.append(text)
+                        on_text(text)
+        return "".join(chunks), False
+    
+    def create_context_cache(self) -> bool:
+        """Move the current conversation into a server-side context cache"""
+        turns = (self.context_cache['contents'] if self.context_cache else []) + list(self.conversation_history)
+        if not turns:
+            return False
+        
+        try:
+            response = self.session.post(
+                f"{self.base_url}/cachedContents?key={self.api_key}",
+                headers={"Content-Type": "application/json"},
+                data=json_dumps({
+                    "model": f"models/{self.cache_model}",
+                    # Artifacts are cached in full; that is what makes caching pay off
+                    "contents": self._build_contents(turns, recent_turns=None),
+                    "ttl": f"{CONTEXT_CACHE_TTL}s"
+                }),
+                timeout=60
+            )
+            if response.status_code != 200:
+                # Usually the content is below the model's minimum cache
+                # size; just keep sending it inline
+                self._show_cache_error(f"{response.status_code} - {response.text}")
+                return False
+            name = json_loads(response.content).get('name')
+            if not name:
+                return False
+        except Exception as e:
+            self._show_cache_error(str(e))
+            return False
+        
+        # The new cache covers everything the old one did
+        if self.context_cache:
+            self._delete_cached_content(self.context_cache['name'])
+        # The turns are kept as stored in the history (artifact placeholders
+        # and all) so they can be restored once the cache is gone
+        self.context_cache = {
+            'name': name,
+            'contents': turns,
+            'expires': time.time() + CONTEXT_CACHE_TTL
+        }
+        self.conversation_history.clear()
+        return True
+    
+    def _show_cache_error(self, reason: str):
+        """Report why a context cache couldn't be created, once per session"""
+        if not self._cache_error_shown:
+            self._cache_error_shown = True
+            print(f"⚠️ Context cache not created, sending files inline: {reason}")
+    
+    def _delete_cached_content(self, cache_name: str) -> bool:
+        """Delete a context cache from Gemini"""
+        try:
+            response = self.session.delete(
+                f"{self.base_url}/{cache_name}?key={self.api_key}",
+                timeout=10
+            )
+            return response.status_code == 200
+        except Exception:
+            return False
+    
+    def delete_context_cache(self, restore: bool = True) -> bool:
+        """Drop the context cache, moving its turns back into the history if restore is set"""
+        if not self.context_cache:
+            return False
+        cache = self.context_cache
+        self.context_cache = None
+        if restore:
+            # Let the restored history grow past the cap rather than drop
+            # its oldest turns (the cached files); the next summary shrinks it
+            turns = cache['contents'] + list(self.conversation_history)
+            self.conversation_history = deque(turns, maxlen=len(turns) + HISTORY_MAX_TURNS)
+        else:
+            self._prune_artifacts()
+        if time.time() < cache['expires']:
+            self._delete_cached_content(cache['name'])
+        return True
+    
+    def show_context_cache(self) -> str:
+        """Describe the active context cache"""
+        if not self.context_cache:
+            return "📦 No context cache"
+        remaining = max(0, int(self.context_cache['expires'] - time.time()))
+        return (f"📦 Context cache: {self.context_cache['name']}\n"
+                f"  • {len(self.context_cache['contents'])} cached turns\n"
+                f"  • Expires in {remaining // 60}m {remaining % 60}s")
+    
+    def _open_response_cache(self) -> Optional[sqlite3.Connection]:
+        """Open (creating if needed) the on-disk response cache"""
+        try:
+            ensure_state_dir()
+            # Replies are private; SQLite gives its -wal/-shm files the
+            # database file's permissions
+            os.close(os.open(RESPONSE_CACHE_PATH, os.O_RDWR | os.O_CREAT, 0o600))
+            os.chmod(RESPONSE_CACHE_PATH, 0o600)
+            conn = sqlite3.connect(RESPONSE_CACHE_PATH, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+            conn.commit()
+            self._prune_response_cache(conn)
+            return conn
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️ Response cache disabled: {e}")
+            return None
+    
+    def _prune_response_cache(self, conn: sqlite3.Connection):
+        """Delete expired replies and all but the newest RESPONSE_CACHE_MAX_ROWS"""
+        try:
+            with conn:
+                conn.execute("DELETE FROM responses WHERE created < ?",
+                             (time.time() - RESPONSE_CACHE_MAX_AGE,))
+                conn.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY created DESC LIMIT ?)",
+                    (RESPONSE_CACHE_MAX_ROWS,)
+                )
+        except sqlite3.Error:
+            pass
+    
+    def _response_cache_key(self, turn: Dict[str, Any]) -> Optional[str]:
+        """Hash the model and the whole conversation (cached prefix included) followed by turn
+        
+        The key is the same whether or not the prefix is in a context cache.
+        """
+        if not self._response_cache:
+            return None
+        turns = (self.context_cache['contents'] if self.context_cache else []) + list(self.conversation_history)
+        turns.append(turn)
+        # cache_model is self.model's pinned version, so one key covers both
+        digest = hashlib.blake2b(self.model.encode(), digest_size=16)
+        digest.update(json_dumps(self._build_contents(turns)))
+        return digest.hexdigest()
+    
+    def _get_cached_response(self, key: Optional[str]) -> Optional[str]:
+        """Look up a stored reply"""
+        if not key:
+            return None
+        try:
+            row = self._response_cache.execute(
+                "SELECT response FROM responses WHERE key = ? AND created >= ?",
+                (key, time.time() - RESPONSE_CACHE_MAX_AGE)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+    
+    def _store_cached_response(self, key: Optional[str], response: str):
+        """Remember a reply"""
+        if not key:
+            return
+        try:
+            with self._response_cache:
+                self._response_cache.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                    (key, response, time.time())
+                )
+        except sqlite3.Error:
+            return
+        self._prune_response_cache(self._response_cache)
+    
+    def clear_response_cache(self) -> int:
+        """Delete all stored replies, returning how many there were"""
+        if not self._response_cache:
+            return 0
+        try:
+            with self._response_cache:
+                return self._response_cache.execute("DELETE FROM responses").rowcount
+        except sqlite3.Error:
+            return 0
+    
+    def show_response_cache(self) -> str:
+        """Describe the on-disk response cache"""
+        if not self._response_cache:
+            return "💾 Response cache disabled"
+        try:
+            count = self._response_cache.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        except sqlite3.Error:
+            count = 0
+        return f"💾 Response cache: {count} replies in {RESPONSE_CACHE_PATH}"
+    
     def show_help(self) -> str:
         """Show help message"""
         return """
@@ -406,6 +1292,8 @@ class GeminiChat:
 💬 Chat Commands:
   • Just type your message to chat with Gemini
   • /clear - Clear conversation history
+  • /cache - Show the context and response caches
+  • /cache clear - Delete the context cache and all cached responses
 
 📁 File Commands:
   • /read <file_path> - Read and analyze a file (text, code, images, videos)
@@ -419,6 +1307,7 @@ class GeminiChat:
   • /cleanup - Delete all uploaded files from Gemini
 
 ❓ Other:
+  • /cancel - Stop the message being processed and drop queued ones
   • /help - Show this help
   • /quit or /exit - Exit the chat
   • Ctrl+C - Exit
@@ -441,39 +1330,163 @@ Examples:
         print("=" * 55)
         print(f"📁 Allowed directories: {', '.join(str(d) for d in self.allowed_dirs)}")
         print("🎬 Supports: MP4, AVI, MOV, MKV, WebM, FLV, WMV, M4V")
+        interrupted = self._prune_upload_state()
+        if interrupted:
+            print(f"⏸️ {len(interrupted)} interrupted upload(s) - /read the file again to resume:")
+            for file_path, entry in interrupted.items():
+                print(f"  • {Path(file_path).name} ({entry.get('offset', 0) / (1024*1024):.1f} "
+                      f"of {entry['size'] / (1024*1024):.1f}MB)")
         print("Type /help for commands or just start chatting!")
         print("=" * 55)
         
+        # Messages are processed on a worker thread so input stays
+        # responsive (e.g. for /cancel) during long uploads and replies
+        input_queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        output_queue: "queue.Queue[tuple]" = queue.Queue()
+        threading.Thread(target=self._worker, args=(input_queue, output_queue), daemon=True).start()
+        self._notify = lambda text: output_queue.put(("notice", text))
+        busy = 0  # Messages queued or being processed
+        prompt_shown = False
+        replying = False  # Between a reply's "start" and "done"
+        deferred_notices = []
+        input_closed = False
+        
         try:
             while True:
                 try:
-                    user_input = input("\n💬 You: ").strip()
+                    # Show whatever the worker produced
+                    while True:
+                        try:
+                            # Without a pollable stdin (Windows) or once it is
+                            # closed, wait for the reply before moving on
+                            block = busy > 0 and (input_closed or not self._can_poll_stdin())
+                            kind, text = output_queue.get(block=block) if block else output_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if kind == "start":
+                            replying = True
+                            print("\n🤖 Gemini: ", end="", flush=True)
+                        elif kind == "text":
+                            sys.stdout.write(text)
+                            sys.stdout.flush()
+                        elif kind == "notice":
+                            if replying:
+                                # Shown once the reply is complete
+                                deferred_notices.append(text)
+                            else:
+                                print(f"\n{text}" if prompt_shown else text)
+                                prompt_shown = False
+                        else:
+                            print(text)
+                            for notice in deferred_notices:
+                                print(notice)
+                            deferred_notices.clear()
+                            busy -= 1
+                            replying = False
+                            prompt_shown = False
+                    
+                    if input_closed:
+                        # Piped input ran out; exit once everything is answered
+                        if busy:
+                            continue
+                        print("\n👋 Goodbye!")
+                        break
+                    
+                    if not prompt_shown and not busy:
+                        print("\n💬 You: ", end="", flush=True)
+                        prompt_shown = True
+                    if not self._stdin_ready(0.1):
+                        continue
+                    
+                    user_input = input().strip()
                     
                     if not user_input:
+                        prompt_shown = busy > 0
                         continue
                         
                     if user_input.lower() in ['/quit', '/exit', 'quit', 'exit']:
                         print("👋 Goodbye!")
                         break
                     
-                    print("\n🤖 Gemini: ", end="", flush=True)
-                    response = self.process_message(user_input)
-                    print(response)
+                    if user_input == "/cancel":
+                        # Drop queued messages and stop the current one
+                        dropped = 0
+                        while True:
+                            try:
+                                input_queue.get_nowait()
+                                dropped += 1
+                            except queue.Empty:
+                                break
+                        busy -= dropped
+                        if busy:
+                            self._cancel.set()
+                            print("🛑 Cancelling...")
+                        else:
+                            print("Nothing to cancel")
+                            prompt_shown = False
+                        continue
+                    
+                    if busy:
+                        print("📥 Queued")
+                    input_queue.put(user_input)
+                    busy += 1
                     
                 except KeyboardInterrupt:
+                    self._cancel.set()
                     print("\n🧹 Cleaning up uploaded files...")
-                    for file_path, file_info in self.uploaded_files.items():
-                        file_name = file_info.get('name')
-                        if file_name:
-                            self.delete_uploaded_file(file_name)
+                    self.delete_uploaded_files()
                     print("👋 Goodbye!")
                     break
                 except EOFError:
-                    print("\n👋 Goodbye!")
-                    break
+                    input_closed = True
                     
         except Exception as e:
             print(f"\n❌ Unexpected error: {str(e)}")
+        finally:
+            input_queue.put(None)
+            self._notify = print
+            self.close()
+    
+    def _worker(self, input_queue: "queue.Queue[Optional[str]]", output_queue: "queue.Queue[tuple]"):
+        """Process messages from input_queue, reporting output on output_queue"""
+        while True:
+            user_input = input_queue.get()
+            if user_input is None:
+                return
+            self._cancel.clear()
+            output_queue.put(("start", ""))
+            
+            streamed = []
+            def show(text):
+                streamed.append(text)
+                output_queue.put(("text", text))
+            try:
+                response = self.process_message(user_input, on_text=show)
+            except Exception as e:
+                response = f"❌ Error: {str(e)}"
+            
+            if not streamed:
+                output_queue.put(("done", response))
+            elif response == "".join(streamed):
+                output_queue.put(("done", ""))
+            else:
+                # Stream broke off; show the error after what arrived
+                output_queue.put(("done", f"\n{response}"))
+    
+    def _can_poll_stdin(self) -> bool:
+        """Whether select() works on stdin (an interactive terminal, not on Windows)
+        
+        Piped input is read ahead into sys.stdin's buffer, where select()
+        on the fd can't see lines that are already waiting.
+        """
+        return os.name != "nt" and sys.stdin.isatty()
+    
+    def _stdin_ready(self, timeout: float) -> bool:
+        """Wait up to timeout for a line on stdin"""
+        if not self._can_poll_stdin():
+            return True  # input() will just block
+        readable, _, _ = select.select([sys.stdin], [], [], timeout)
+        return bool(readable)
 
 
 def main():
@@ -481,6 +1494,8 @@ def main():
     parser.add_argument("--api-key", help="Gemini API key (or set GEMINI_API_KEY env var)")
     parser.add_argument("--dirs", nargs="+", default=["."], 
                        help="Allowed directories for file access (default: current directory)")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="Don't reuse or store replies in the local response cache")
     
     args = parser.parse_args()
     
@@ -492,7 +1507,7 @@ def main():
         sys.exit(1)
     
     # Create and run chat
-    chat = GeminiChat(api_key, args.dirs)
+    chat = GeminiChat(api_key, args.dirs, response_cache=not args.no_cache)
     chat.run()
 
 